@@ -1,22 +1,40 @@
+import asyncio
+import functools
+import hashlib
+import io
+import json
 import os
-from dataclasses import dataclass
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
-import requests
+import httpx
+import PIL
 from PIL import Image, ImageDraw, ImageFont
 from telegram import Bot, InputSticker
 from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
 
 
 IMAGES_DIR = Path(__file__).parent / "images"
 ICONS_DIR = IMAGES_DIR / "icons"  # PNG-иконки погоды 225x225 (01d.png, 02n.png и т.п.)
+CACHE_DIR = Path(__file__).parent / "cache"  # готовые статические слои (фон + иконка + город + °C)
 
 # Погодные фоны (кладём в images/): bg_01d.png, bg_01n.png, ..., bg_50n.png
 BG_PREFIX = "bg_"
 BG_FALLBACK_1 = "bg_fallback.png"  # опционально (если есть)
 BG_FALLBACK_2 = "bg_01d.png"       # запасной вариант, если нет bg_fallback.png
 
+# Все коды иконок OpenWeather (день/ночь), для которых лежат фоны и иконки
+KNOWN_ICON_CODES = [
+    f"{num}{part}"
+    for num in ("01", "02", "03", "04", "09", "10", "11", "13", "50")
+    for part in ("d", "n")
+]
+
 
 # ==========================
 #   НАСТРОЙКИ МАКЕТА
@@ -90,7 +108,7 @@ DETAILS_LAYOUT = DetailsLayout(
     x=50,
     y=290,
     font_size=30,
-    line_spacing=6,
+    line_spacing=2,  # multiline_text: шаг строки = высота шрифта + spacing (31 + 2 при 30px)
 )
 
 # Позиция иконки погоды (из локальных PNG 225x225)
@@ -108,21 +126,20 @@ class CityConfig:
     name: str          # как написать город на стикере
     query: str         # как отдать город в API
     emoji: str         # эмодзи для стикера
-    output: str        # куда сохранить png
     tz_offset_hours: int = 0  # смещение от UTC, для локального времени города
 
 
 CITIES = [
-    CityConfig(name="Ufa",         query="Ufa,RU",          emoji="🏙️", output="sticker_ufa.png",         tz_offset_hours=5),
-    CityConfig(name="Neftekamsk",  query="Neftekamsk,RU",   emoji="🏙️", output="sticker_neftekamsk.png",  tz_offset_hours=5),
-    CityConfig(name="Dyurtyuli",   query="Dyurtyuli,RU",    emoji="🏙️", output="sticker_dyurtyuli.png",   tz_offset_hours=5),
-    CityConfig(name="Mesyagutovo", query="Mesyagutovo,RU",  emoji="🏙️", output="sticker_mesyagutovo.png", tz_offset_hours=5),
-    CityConfig(name="Kushnarenkovo", query="Kushnarënkovo, RU", emoji="🏙️", output="sticker_kushnarenkovo.png", tz_offset_hours=5),
-    CityConfig(name="Tuymazy",     query="Tuymazy,RU",      emoji="🏙️", output="sticker_tuymazy.png",     tz_offset_hours=5),
-    CityConfig(name="Sterlitamak", query="Sterlitamak,RU",  emoji="🏙️", output="sticker_sterlitamak.png", tz_offset_hours=5),
-    CityConfig(name="Salavat",     query="Salavat,RU",      emoji="🏙️", output="sticker_salavat.png",     tz_offset_hours=5),
-    CityConfig(name="Meleuz",      query="Meleuz,RU",       emoji="🏙️", output="sticker_meleuz.png",      tz_offset_hours=5),
-    CityConfig(name="Kumertau",    query="Kumertau,RU",     emoji="🏙️", output="sticker_kumertau.png",    tz_offset_hours=5),
+    CityConfig(name="Ufa",         query="Ufa,RU",          emoji="🏙️", tz_offset_hours=5),
+    CityConfig(name="Neftekamsk",  query="Neftekamsk,RU",   emoji="🏙️", tz_offset_hours=5),
+    CityConfig(name="Dyurtyuli",   query="Dyurtyuli,RU",    emoji="🏙️", tz_offset_hours=5),
+    CityConfig(name="Mesyagutovo", query="Mesyagutovo,RU",  emoji="🏙️", tz_offset_hours=5),
+    CityConfig(name="Kushnarenkovo", query="Kushnarënkovo, RU", emoji="🏙️", tz_offset_hours=5),
+    CityConfig(name="Tuymazy",     query="Tuymazy,RU",      emoji="🏙️", tz_offset_hours=5),
+    CityConfig(name="Sterlitamak", query="Sterlitamak,RU",  emoji="🏙️", tz_offset_hours=5),
+    CityConfig(name="Salavat",     query="Salavat,RU",      emoji="🏙️", tz_offset_hours=5),
+    CityConfig(name="Meleuz",      query="Meleuz,RU",       emoji="🏙️", tz_offset_hours=5),
+    CityConfig(name="Kumertau",    query="Kumertau,RU",     emoji="🏙️", tz_offset_hours=5),
 ]
 
 
@@ -130,20 +147,52 @@ CITIES = [
 #   ШРИФТ
 # ==========================
 
-def get_font(size: int) -> ImageFont.FreeTypeFont:
-    font_paths = [
-        "font.ttf",
-        "Font.ttf",
-        "fonts/font.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-    ]
-    for path in font_paths:
+FONT_PATHS = [
+    "font.ttf",
+    "Font.ttf",
+    "fonts/font.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+]
+
+
+def _resolve_font_path() -> str | None:
+    for path in FONT_PATHS:
         if os.path.exists(path):
             try:
-                return ImageFont.truetype(path, size)
+                ImageFont.truetype(path, 10)
             except OSError:
                 continue
-    return ImageFont.load_default()
+            return path
+    return None
+
+
+# Путь к шрифту ищем один раз при импорте
+_FONT_PATH = _resolve_font_path()
+
+
+@functools.lru_cache(maxsize=16)
+def get_font(size: int) -> ImageFont.FreeTypeFont:
+    if _FONT_PATH is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(_FONT_PATH, size)
+
+
+# ==========================
+#   КЭШ НА ДИСКЕ
+# ==========================
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    # пишем во временный файл рядом и переименовываем: параллельный запуск
+    # никогда не увидит недописанный файл
+    path.parent.mkdir(exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
 
 
 # ==========================
@@ -160,7 +209,51 @@ class WeatherInfo:
     icon_code: str       # код иконки, например "01d"
 
 
-def fetch_weather(city: CityConfig) -> WeatherInfo:
+# Ответы OpenWeather живут WEATHER_CACHE_TTL секунд и лежат в cache/weather.json:
+# ретрай или перекрывающийся запуск в течение TTL не дёргают API заново
+WEATHER_CACHE_PATH = CACHE_DIR / "weather.json"
+WEATHER_CACHE_TTL = 300
+
+
+def _load_weather_cache() -> dict[str, tuple[float, WeatherInfo]]:
+    try:
+        raw = json.loads(WEATHER_CACHE_PATH.read_text(encoding="utf-8"))
+        return {
+            query: (entry["ts"], WeatherInfo(**entry["weather"]))
+            for query, entry in raw.items()
+        }
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+        print(f"[warn] broken weather cache {WEATHER_CACHE_PATH}: {e}")
+        return {}
+
+
+def _save_weather_cache() -> None:
+    raw = {
+        query: {"ts": ts, "weather": asdict(weather)}
+        for query, (ts, weather) in _weather_cache.items()
+    }
+    _write_atomic(WEATHER_CACHE_PATH, json.dumps(raw, ensure_ascii=False).encode("utf-8"))
+
+
+_weather_cache = _load_weather_cache()
+
+
+def _http_client() -> httpx.AsyncClient:
+    # один асинхронный клиент (HTTP/2, keep-alive) на все запросы к погоде за запуск
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=10,
+        limits=httpx.Limits(max_connections=20),
+    )
+
+
+async def fetch_weather(client: httpx.AsyncClient, city: CityConfig) -> WeatherInfo:
+    cached = _weather_cache.get(city.query)
+    if cached is not None and time.time() - cached[0] < WEATHER_CACHE_TTL:
+        return cached[1]
+
     api_key = os.environ["WEATHER_API_KEY"]
     url = "https://api.openweathermap.org/data/2.5/weather"
     params = {
@@ -168,7 +261,7 @@ def fetch_weather(city: CityConfig) -> WeatherInfo:
         "appid": api_key,
         "units": "metric",
     }
-    resp = requests.get(url, params=params, timeout=10)
+    resp = await client.get(url, params=params)
     resp.raise_for_status()
     data = resp.json()
 
@@ -176,7 +269,7 @@ def fetch_weather(city: CityConfig) -> WeatherInfo:
     wind = data.get("wind", {})
     weather0 = data["weather"][0]
 
-    return WeatherInfo(
+    weather = WeatherInfo(
         temp=main["temp"],
         humidity=main["humidity"],
         wind_speed=wind.get("speed", 0.0),
@@ -184,48 +277,119 @@ def fetch_weather(city: CityConfig) -> WeatherInfo:
         condition_main=weather0.get("main", "Default"),
         icon_code=weather0.get("icon", ""),  # например: "01d"
     )
+    _weather_cache[city.query] = (time.time(), weather)
+    return weather
 
 
 # ==========================
 #   ФОН ПО ПОГОДЕ
 # ==========================
 
+def _list_dir(path: Path) -> set[str]:
+    if not path.is_dir():
+        return set()
+    return {p.name for p in path.iterdir()}
+
+
+# Содержимое папок читаем один раз при импорте — дальше проверки без stat()
+_AVAILABLE_BGS = _list_dir(IMAGES_DIR)
+_AVAILABLE_ICONS = _list_dir(ICONS_DIR)
+
+
+@functools.lru_cache(maxsize=32)
 def _get_background_path(icon_code: str) -> Path:
     """
     Возвращает путь к фону на основе icon_code (например "01d" -> images/bg_01d.png).
-    Если не найден — пытается взять fallback.
+    Если не найден — пытается взять fallback. Результат кэшируется (список файлов
+    всё равно читается один раз при импорте), так что предупреждение печатается один раз.
     """
     if icon_code:
-        candidate = IMAGES_DIR / f"{BG_PREFIX}{icon_code}.png"
-        if candidate.exists():
-            return candidate
-        print(f"[warn] weather bg not found for icon '{icon_code}': {candidate}")
+        name = f"{BG_PREFIX}{icon_code}.png"
+        if name in _AVAILABLE_BGS:
+            return IMAGES_DIR / name
+        print(f"[warn] weather bg not found for icon '{icon_code}': {IMAGES_DIR / name}")
 
     # fallback #1: bg_fallback.png (если есть)
-    fb1 = IMAGES_DIR / BG_FALLBACK_1
-    if fb1.exists():
-        return fb1
+    if BG_FALLBACK_1 in _AVAILABLE_BGS:
+        return IMAGES_DIR / BG_FALLBACK_1
 
     # fallback #2: bg_01d.png (ожидаемо существует)
-    fb2 = IMAGES_DIR / BG_FALLBACK_2
-    if fb2.exists():
-        return fb2
+    if BG_FALLBACK_2 in _AVAILABLE_BGS:
+        return IMAGES_DIR / BG_FALLBACK_2
 
     raise FileNotFoundError(
         "No suitable background found. Expected one of:\n"
         f"- {IMAGES_DIR / f'{BG_PREFIX}{icon_code}.png'}\n"
-        f"- {fb1}\n"
-        f"- {fb2}\n"
+        f"- {IMAGES_DIR / BG_FALLBACK_1}\n"
+        f"- {IMAGES_DIR / BG_FALLBACK_2}\n"
         "Put weather backgrounds into the images/ folder."
     )
 
 
+# ==========================
+#   КЭШ КАРТИНОК
+# ==========================
+
+@functools.lru_cache(maxsize=32)
+def _load_bg(icon_code: str) -> Image.Image:
+    """
+    Декодированный RGBA-фон для icon_code. Альфа нужна: у фонов прозрачные
+    скруглённые углы. Общий для всех городов — перед рисованием делайте .copy().
+    """
+    return Image.open(_get_background_path(icon_code)).convert("RGBA")
+
+
+@functools.lru_cache(maxsize=32)
+def _load_icon(icon_code: str) -> Image.Image | None:
+    """
+    Иконка погоды, уже приведённая к RGBA и ICON_SIZE. None, если файла нет.
+    """
+    name = f"{icon_code}.png"
+    if name not in _AVAILABLE_ICONS:
+        print(f"[warn] icon not found: {ICONS_DIR / name}")
+        return None
+
+    icon = Image.open(ICONS_DIR / name).convert("RGBA")
+    if icon.size != ICON_SIZE:
+        icon = icon.resize(ICON_SIZE, Image.LANCZOS)
+    return icon
+
+
+def _warm_image_cache() -> None:
+    # Греем кэш заранее, чтобы параллельные города не декодировали одно и то же
+    for icon_code in KNOWN_ICON_CODES:
+        _load_bg(icon_code)
+        _load_icon(icon_code)
+
+
+_warm_image_cache()
+
+
 # ==========================
 #   РИСОВАЛКИ
 # ==========================
 
+@functools.lru_cache(maxsize=256)
+def _text_width(font_size: int, text: str) -> int:
+    # getlength дешевле textbbox: только advance-ширина, без расчёта bbox глифов
+    return round(get_font(font_size).getlength(text))
+
+
+@functools.lru_cache(maxsize=256)
+def _render_text_bitmap(text: str, font_size: int) -> tuple[Image.Image, int, int]:
+    """
+    Растеризует текст один раз в L-маску. Возвращает (маску, dx, dy) —
+    смещение маски относительно точки, куда рисовал бы draw.text.
+    Повторяющиеся строки ("°C", месяцы, цифры) дальше просто вставляются через paste.
+    """
+    font = get_font(font_size)
+    left, top, right, bottom = font.getbbox(text)
+    mask = Image.new("L", (max(right - left, 0), max(bottom - top, 0)), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+    return mask, left, top
+
+
 def _draw_text_block(
-    draw: ImageDraw.ImageDraw,
     img: Image.Image,
     text: str,
     layout: BlockLayout,
@@ -235,9 +399,9 @@ def _draw_text_block(
     fill=(255, 255, 255, 255),
 ) -> tuple[int, int, int, int]:
     font = get_font(layout.font_size)
-    tb = draw.textbbox((0, 0), text, font=font)
-    text_w = tb[2] - tb[0]
-    text_h = tb[3] - tb[1]
+    text_w = _text_width(layout.font_size, text)
+    ascent, descent = font.getmetrics()
+    text_h = ascent + descent
 
     # ---------- X ----------
     if layout.x is not None:
@@ -258,7 +422,8 @@ def _draw_text_block(
     else:
         y = img.height - text_h - 40
 
-    draw.text((x, y), text, font=font, fill=fill)
+    mask, dx, dy = _render_text_bitmap(text, layout.font_size)
+    img.paste(fill, (x + dx, y + dy), mask)
     return x, y, text_w, text_h
 
 
@@ -270,125 +435,243 @@ def _draw_details_block(draw: ImageDraw.ImageDraw, img: Image.Image, weather: We
         weather.description,
     ]
 
-    x = DETAILS_LAYOUT.x
-    y = DETAILS_LAYOUT.y
-
-    for line in lines:
-        lb = draw.textbbox((0, 0), line, font=font)
-        h = lb[3] - lb[1]
-        draw.text((x, y), line, font=font, fill=(255, 255, 255, 255))
-        y += h + DETAILS_LAYOUT.line_spacing
+    # один вызов вместо цикла: межстрочный интервал Pillow считает сам
+    draw.multiline_text(
+        (DETAILS_LAYOUT.x, DETAILS_LAYOUT.y),
+        "\n".join(lines),
+        font=font,
+        fill=(255, 255, 255, 255),
+        spacing=DETAILS_LAYOUT.line_spacing,
+    )
 
 
 def _paste_icon(img: Image.Image, icon_code: str) -> None:
     if not icon_code:
         return
 
-    icon_path = ICONS_DIR / f"{icon_code}.png"
-    if not icon_path.exists():
-        print(f"[warn] icon not found: {icon_path}")
+    icon = _load_icon(icon_code)
+    if icon is None:
         return
 
-    icon = Image.open(icon_path).convert("RGBA")
-    if icon.size != ICON_SIZE:
-        icon = icon.resize(ICON_SIZE, Image.LANCZOS)
-
+    # alpha_composite, а не paste с маской: иконка заходит на прозрачный угол фона
     img.alpha_composite(icon, (ICON_X, ICON_Y))
 
 
+# ==========================
+#   СТАТИЧЕСКИЙ СЛОЙ
+# ==========================
+
+def _file_stamp(path: Path | str | None) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+# Поднимать вручную при изменении того, как рисуется статический слой
+STATIC_LAYER_FORMAT = 1
+
+
+def _static_layer_key(icon_code: str) -> str:
+    """
+    Короткий хэш всего, что влияет на статический слой: формата, версии Pillow
+    (растеризация у Pillow и pillow-simd отличается), макета, шрифта и самих
+    файлов фона и иконки (mtime + размер). При правке любого из них старые файлы
+    в cache/ просто перестают совпадать по имени.
+    """
+    bg_path = _get_background_path(icon_code)
+    parts = (
+        STATIC_LAYER_FORMAT, PIL.__version__,
+        CITY_LAYOUT, DEGREE_LAYOUT, ICON_X, ICON_Y, ICON_SIZE,
+        _FONT_PATH, _file_stamp(_FONT_PATH),
+        bg_path.name, _file_stamp(bg_path),
+        _file_stamp(ICONS_DIR / f"{icon_code}.png"),
+    )
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:8]
+
+
+@functools.lru_cache(maxsize=32)
+def _load_base(icon_code: str) -> Image.Image:
+    """
+    Фон с уже вставленной иконкой погоды. Смешивание по альфе делается один раз
+    на icon_code, а не на каждый город с такой погодой. Перед рисованием — .copy().
+    """
+    img = _load_bg(icon_code).copy()
+    _paste_icon(img, icon_code)
+    return img
+
+
+@functools.lru_cache(maxsize=64)
+def _load_static_layer(city_name: str, icon_code: str) -> Image.Image:
+    """
+    Фон + иконка + название города + "°C" — всё, что не меняется от запуска
+    к запуску. Рисуется один раз и кладётся в cache/static_{city}_{icon_code}_{key}.png;
+    внутри процесса держится в памяти. Общий — перед рисованием делайте .copy().
+    """
+    cache_path = CACHE_DIR / f"static_{city_name}_{icon_code}_{_static_layer_key(icon_code)}.png"
+    if cache_path.exists():
+        try:
+            with Image.open(cache_path) as cached:
+                return cached.convert("RGBA")
+        except OSError as e:
+            print(f"[warn] broken static layer cache {cache_path}: {e}")
+
+    img = _load_base(icon_code).copy()
+
+    # --- БЛОК "°C" ---
+    _draw_text_block(
+        img,
+        "°C",
+        DEGREE_LAYOUT,
+        default_y=70,
+    )
+
+    # --- Город ---
+    _draw_text_block(img, city_name, CITY_LAYOUT)
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=False, compress_level=1)
+    _write_atomic(cache_path, buf.getvalue())
+
+    # слои этого города/иконки со старым ключом больше не совпадут — убираем,
+    # чтобы cache/ (он сохраняется между запусками в CI) не рос бесконечно
+    for stale in CACHE_DIR.glob(f"static_{city_name}_{icon_code}_*.png"):
+        if stale != cache_path:
+            stale.unlink(missing_ok=True)
+    return img
+
+
+def _render_static_layer(city: CityConfig, icon_code: str) -> Image.Image:
+    return _load_static_layer(city.name, icon_code).copy()
+
+
 # ==========================
 #   ГЕНЕРАЦИЯ КАРТИНКИ
 # ==========================
 
+def _encode_png(img: Image.Image) -> io.BytesIO:
+    # RGBA без палитры: в градиентах фона тысячи цветов, квантование даёт полосы.
+    # Сразу в память, без файла на диске; zlib level 1 — Telegram всё равно перекодирует
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=False, compress_level=1)
+    buf.seek(0)
+    return buf
+
+
 def generate_weather_image(
     city: CityConfig,
     weather: WeatherInfo,
-    output_path: str,
     day_text: str,
     month_text: str,
     time_text: str,
-) -> None:
-    # --- фон по погоде (bg_01d.png, bg_02n.png, ...) ---
-    bg_path = _get_background_path(weather.icon_code)
-    img = Image.open(bg_path).convert("RGBA")
-    draw = ImageDraw.Draw(img)
-
-    # --- иконка погоды ---
-    _paste_icon(img, weather.icon_code)
+) -> io.BytesIO:
+    # --- фон по погоде + иконка, город и "°C" (из кэша статических слоёв) ---
+    img = _render_static_layer(city, weather.icon_code)
 
     # --- ТЕМПЕРАТУРА (цифры) с правой выключкой ---
     temp_text = f"{round(weather.temp):d}"
     _draw_text_block(
-        draw,
         img,
         temp_text,
         TEMP_LAYOUT,
         default_y=70,
     )
 
-    # --- БЛОК "°C" ---
-    _draw_text_block(
-        draw,
-        img,
-        "°C",
-        DEGREE_LAYOUT,
-        default_y=70,
-    )
-
-    # --- Город ---
-    _draw_text_block(draw, img, city.name, CITY_LAYOUT)
-
     # --- Дата / время обновления ---
-    _draw_text_block(draw, img, day_text, DAY_LAYOUT)
-    _draw_text_block(draw, img, month_text, MONTH_LAYOUT)
-    _draw_text_block(draw, img, time_text, TIME_LAYOUT)
+    _draw_text_block(img, day_text, DAY_LAYOUT)
+    _draw_text_block(img, month_text, MONTH_LAYOUT)
+    _draw_text_block(img, time_text, TIME_LAYOUT)
 
     # --- Детали (3 строки) ---
+    draw = ImageDraw.Draw(img)
+    draw.fontmode = "L"  # сглаживание через L-маску
     _draw_details_block(draw, img, weather)
 
-    img.save(output_path, format="PNG")
+    return _encode_png(img)
 
 
 # ==========================
 #   ОБНОВЛЕНИЕ СТИКЕРОВ
 # ==========================
 
+# Английские сокращения месяцев — как strftime("%b") в C-локали, но без зависимости от локали
+_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def _render_city(city: CityConfig, weather: WeatherInfo, city_now: datetime) -> io.BytesIO:
+    day_text = f"{city_now.day:02d}"
+    month_text = _MONTHS[city_now.month - 1]
+    time_text = f"{city_now.hour:02d}:{city_now.minute:02d}"
+
+    return generate_weather_image(city, weather, day_text, month_text, time_text)
+
+
 async def update_stickers() -> None:
     token = os.environ["BOT_TOKEN"]
     set_name = os.environ["STICKER_SET_NAME"]
     set_title = os.environ["STICKER_SET_TITLE"]
     owner_user_id = int(os.environ["TELEGRAM_USER_ID"])
 
-    bot = Bot(token)
+    # по умолчанию у Bot пул из одного соединения — параллельные загрузки
+    # в нём просто встали бы в очередь
+    bot = Bot(token, request=HTTPXRequest(connection_pool_size=len(CITIES)))
 
-    new_stickers: list[InputSticker] = []
-
-    for city in CITIES:
-        weather = fetch_weather(city)
-
-        utc_now = datetime.utcnow()
-        city_now = utc_now + timedelta(hours=city.tz_offset_hours)
-
-        day_text = city_now.strftime("%d")
-        month_text = city_now.strftime("%b")
-        time_text = city_now.strftime("%H:%M")
+    # локальное время считаем один раз на каждое смещение, а не на каждый город
+    tz_cache = {
+        off: datetime.now(timezone(timedelta(hours=off)))
+        for off in {c.tz_offset_hours for c in CITIES}
+    }
 
-        generate_weather_image(city, weather, city.output, day_text, month_text, time_text)
+    # gather сохраняет порядок CITIES — важно для замены стикеров по позициям ниже.
+    # Погода — I/O, все запросы идут прямо в event loop, без потоков
+    # return_exceptions: клиент закрывается только когда все запросы завершились,
+    # даже если какой-то упал; первую ошибку пробрасываем уже после блока
+    async with _http_client() as client:
+        weather_results = await asyncio.gather(
+            *(fetch_weather(client, city) for city in CITIES),
+            return_exceptions=True,
+        )
+    # удачные ответы сохраняем до проброса ошибки: ретрай возьмёт их из кэша
+    # и перезапросит только упавшие города
+    _save_weather_cache()
+    for result in weather_results:
+        if isinstance(result, BaseException):
+            raise result
+    weather_list: list[WeatherInfo] = weather_results
+
+    # Рисование упирается в CPU: отдельный пул по числу ядер,
+    # Pillow отпускает GIL внутри своих C-функций
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        bio_list = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    executor, _render_city, city, weather, tz_cache[city.tz_offset_hours]
+                )
+                for city, weather in zip(CITIES, weather_list)
+            )
+        )
 
-        with open(city.output, "rb") as f:
-            uploaded = await bot.upload_sticker_file(
+    uploaded_list = await asyncio.gather(
+        *(
+            bot.upload_sticker_file(
                 user_id=owner_user_id,
-                sticker=f,
+                sticker=bio,
                 sticker_format="static",
             )
+            for bio in bio_list
+        )
+    )
 
-        new_stickers.append(
-            InputSticker(
-                sticker=uploaded.file_id,
-                emoji_list=[city.emoji],
-                format="static",
-            )
+    new_stickers: list[InputSticker] = [
+        InputSticker(
+            sticker=uploaded.file_id,
+            emoji_list=[city.emoji],
+            format="static",
         )
+        for city, uploaded in zip(CITIES, uploaded_list)
+    ]
 
     try:
         sticker_set = await bot.get_sticker_set(set_name)
@@ -453,5 +736,4 @@ async def update_stickers() -> None:
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(update_stickers())